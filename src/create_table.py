@@ -129,6 +129,37 @@ def create_money_table():
         print(e)
 
 
+def create_leases_table():
+    try:
+        client.create_table(
+            TableName="Leases",
+            # Declare your Primary Key in the KeySchema argument
+            KeySchema=[
+                {
+                    "AttributeName": "account",
+                    "KeyType": "HASH"
+                }
+            ],
+            # Any attributes used in KeySchema or Indexes must be declared in AttributeDefinitions
+            AttributeDefinitions=[
+                {
+                    "AttributeName": "account",
+                    "AttributeType": "S"
+                }
+            ],
+            # ProvisionedThroughput controls the amount of data you can read or write to DynamoDB per second.
+            # You can control read and write capacity independently.
+            ProvisionedThroughput={
+                "ReadCapacityUnits": 1,
+                "WriteCapacityUnits": 1
+            }
+        )
+        print("Tables created successfully!")
+    except Exception as e:
+        print("Error creating table:")
+        print(e)
+
+
 def populate_trx():
     dynamodb = session.resource('dynamodb', region_name='ap-northeast-1', endpoint_url="http://localhost:8000")
     trx_l = [
@@ -220,6 +251,7 @@ if __name__ == '__main__':
     create_devices_table()
     create_trx_table()
     create_money_table()
+    create_leases_table()
     populate_trx()
     populate_money_table()
     populate_device_table()
\ No newline at end of file
@@ -2,18 +2,25 @@
 
 from __future__ import annotations
 
+import copy
+import gzip
+import hashlib
+import heapq
+import json
 import os
+import time
 from collections import defaultdict
 from datetime import datetime
 from decimal import Decimal
 from enum import Enum
 from ipaddress import IPv4Address
-from typing import List, Union, Optional
+from typing import List, Union, Optional, Tuple
 from urllib.parse import urljoin
-from uuid import UUID
+from uuid import UUID, uuid4, uuid5, NAMESPACE_URL
 
 import boto3
 import requests
+from botocore.exceptions import ClientError
 from dateutil.parser import parse, ParserError
 from discord_webhook import DiscordWebhook, DiscordEmbed
 from pydantic import BaseModel, condecimal, EmailStr
@@ -33,6 +40,17 @@ else:
 GIGABYTES = 1000 ** 3
 MEGABYTES = 1000 ** 2
 
+# Discord limits: https://discord.com/developers/docs/resources/message#embed-object-embed-limits
+EMBED_FIELD_VALUE_LIMIT = 1024
+EMBED_FIELDS_LIMIT = 25
+EMBED_TOTAL_LIMIT = 6000  # also the limit of all embeds in one message
+MESSAGE_EMBEDS_LIMIT = 10
+
+TRANSACT_ITEMS_LIMIT = 100  # max number of actions in one TransactWriteItems request
+
+TOP_DEVICES = int(os.environ.get('TOP_DEVICES', 20))  # devices shown one by one, the others are rolled up
+TOP_COUNTRIES = 5  # countries shown in the roll-up, the others are shown as "others"
+
 BASE_URL = 'https://earnapp.com/dashboard/api/'
 user_data_endpoint = urljoin(BASE_URL, 'user_data')
 money_endpoint = urljoin(BASE_URL, 'money')
@@ -57,12 +75,40 @@ else:
 WEBHOOK_URL = os.environ['WEBHOOK_URL']
 TOKEN = os.environ['TOKEN']
 
+# only one invocation per account fetches and notifies, the others return its result
+LEASE_ACCOUNT = os.environ.get('LEASE_ACCOUNT') or hashlib.sha256(TOKEN.encode()).hexdigest()[:16]
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', 60))  # used when the remaining time of invocation is unknown
+RESULT_SECONDS = int(os.environ.get('RESULT_SECONDS', 120))  # how long the result is returned to later invocations
+LEASE_POLL_SECONDS = 0.5  # interval of checking whether the invocation holding the lease has written its result
+
+# directory or s3://bucket/prefix to write a snapshot of every run into (for replaying it later with replay.py),
+# disabled if empty
+CAPTURE_DIR = os.environ.get('CAPTURE_DIR', '')
+
 header = {
     'cookie': f'auth=1; auth-method=google; oauth-refresh-token={TOKEN}'
 }
 params = (('appid', 'earnapp_dashboard'),)
 
 
+@retry(wait=wait_fixed(30), stop=stop_after_attempt(5))
+def fetch_from_earnapp(endpoint: str, model):
+    """
+    Given an EarnApp Dashboard API endpoint and the model of its response, return the raw (json decoded) response
+    and the parsed one. Parsing is retried too, an expired token or an error payload fails there.
+    :return: (list or dict got from the endpoint, model or list of models)
+    """
+    res = requests.get(
+        endpoint,
+        headers=header,
+        params=params
+    )
+    raw = res.json()
+    if isinstance(raw, list):
+        return raw, [model(**x) for x in raw]
+    return raw, model(**raw)
+
+
 class TransactionStatus(str, Enum):
     paid = 'paid'
     approved = 'approved'
@@ -81,81 +127,75 @@ class Transaction(BaseModel):
     promo_bonuses_amount: condecimal(ge=0)
 
     @staticmethod
-    @retry(wait=wait_fixed(30), stop=stop_after_attempt(5))
     def get_trx_from_earnapp() -> List[Transaction]:
-        tx_res = requests.get(
-            transaction_endpoint,
-            headers=header,
-            params=params
-        )
+        return fetch_from_earnapp(transaction_endpoint, Transaction)[1]
 
-        return list(map(lambda x: Transaction(**x), tx_res.json()))
+    @staticmethod
+    def from_db_item(item: dict) -> Transaction:
+        trx = dict(item)  # do not modify the item got from DB
+        try:
+            trx['payment_date'] = parse(trx['payment_date'])
+        except ParserError as e:
+            trx['payment_date'] = None
+        return Transaction(**trx)
+
+    def to_db_item(self) -> dict:
+        return {
+            'uuid': self.uuid,
+            'status': self.status,
+            'email': self.email,
+            'date': str(self.date),
+            'payment_method': self.payment_method,
+            'payment_date': str(self.payment_date),
+            'money_amount': self.money_amount,
+            'ref_bonuses_amount': self.ref_bonuses_amount,
+            'promo_bonuses_amount': self.promo_bonuses_amount
+        }
+
+    def update_params(self) -> dict:
+        update_str = 'set #fn = :s'
+        update_values = {
+            ':s': self.status
+        }
+        if self.payment_date is not None:
+            update_str = update_str + ', payment_date = :pd'
+            update_values[':pd'] = str(self.payment_date)
+
+        return dict(
+            Key={
+                'uuid': self.uuid
+            },
+            UpdateExpression=update_str,
+            ExpressionAttributeNames={
+                '#fn': 'status'
+            },
+            ExpressionAttributeValues=update_values
+        )
 
     @staticmethod
     def insert_trx_to_dynamodb(ret_l, table):
         with table.batch_writer() as batch:
             for trx in ret_l:
-                batch.put_item(Item={
-                    'uuid': trx.uuid,
-                    'status': trx.status,
-                    'email': trx.email,
-                    'date': str(trx.date),
-                    'payment_method': trx.payment_method,
-                    'payment_date': str(trx.payment_date),
-                    'money_amount': trx.money_amount,
-                    'ref_bonuses_amount': trx.ref_bonuses_amount,
-                    'promo_bonuses_amount': trx.promo_bonuses_amount
-                })
-
-    @staticmethod
-    def update_transactions(trx_l: List[Transaction], table=None):
-        if table is None:
-            table = dynamodb.Table('Transactions')
-
-        for trx in trx_l:
-            update_str = 'set #fn = :s'
-            update_values = {
-                ':s': trx.status
-            }
-            if trx.payment_date is not None:
-                update_str = update_str + ', payment_date = :pd'
-                update_values[':pd'] = str(trx.payment_date)
-
-            table.update_item(
-                Key={
-                    'uuid': trx.uuid
-                },
-                UpdateExpression=update_str,
-                ExpressionAttributeNames={
-                    '#fn': 'status'
-                },
-                ExpressionAttributeValues=update_values,
-                ReturnValues="UPDATED_NEW"
-            )
+                batch.put_item(Item=trx.to_db_item())
 
     @staticmethod
     def get_all_trx_from_db(table=None) -> List[Transaction]:
         if table is None:
             table = dynamodb.Table('Transactions')
         resp = table.scan()
-        ret = []
-        for trx in resp['Items']:
-            try:
-                trx['payment_date'] = parse(trx['payment_date'])
-            except ParserError as e:
-                trx['payment_date'] = None
-            ret.append(Transaction(**trx))
-        return ret
+        return [Transaction.from_db_item(trx) for trx in resp['Items']]
 
     @staticmethod
     def get_non_paid_trx_from_db(table=None) -> List[Transaction]:
         # TODO: rewrite scan to a query with OR condition if possible
         if table is None:
             table = dynamodb.Table('Transactions')
-        all_trx = Transaction.get_all_trx_from_db(table)
-        resp = [trx for trx in all_trx if
+        return Transaction.filter_non_paid(Transaction.get_all_trx_from_db(table))
+
+    @staticmethod
+    def filter_non_paid(trx_l: List[Transaction]) -> List[Transaction]:
+        return [trx for trx in trx_l if
                 trx.status == TransactionStatus.approved or trx.status == TransactionStatus.pending_procedure]
-        return resp
 
 
 class RedeemDetails(TypedDict):
@@ -178,14 +218,8 @@ class Money(BaseModel):
     referral_part: str
 
     @staticmethod
-    @retry(wait=wait_fixed(30), stop=stop_after_attempt(5))
     def get_money_data_from_earnapp() -> Money:
-        money_res = requests.get(
-            money_endpoint,
-            headers=header,
-            params=params
-        )
-        return Money(**money_res.json())
+        return fetch_from_earnapp(money_endpoint, Money)[1]
 
     @staticmethod
     def get_money_data(email: str, table=None) -> Money:
@@ -194,12 +228,9 @@ class Money(BaseModel):
         resp = table.get_item(Key={"email": email})
         return Money(**resp['Item'])
 
-    def write_to_db(self, table=None):
-        if table is None:
-            table = dynamodb.Table('Money')
-
+    def update_params(self) -> dict:
         update_str = "set balance=:b, multiplier=:m, multiplier_icon=:mi, multiplier_hint=:mh, earnings_total= :ea"
-        table.update_item(
+        return dict(
             Key={
                 'email': self.redeem_details['email']
             },
@@ -210,8 +241,7 @@ class Money(BaseModel):
                 ':mi': self.multiplier_icon,
                 ':mh': self.multiplier_hint,
                 ':ea': self.earnings_total,
-            },
-            ReturnValues="UPDATED_NEW"
+            }
         )
 
 
@@ -264,14 +294,8 @@ class Device(BaseModel):
         return number_of_cents * Decimal((Decimal(0.01) / self.rate) * GIGABYTES)
 
     @staticmethod
-    @retry(wait=wait_fixed(30), stop=stop_after_attempt(5))
     def get_devices_info_from_earnapp() -> List[Device]:
-        dev_res = requests.get(
-            devices_endpoint,
-            headers=header,
-            params=params
-        )
-        return list(map(lambda x: Device(**x), dev_res.json()))
+        return fetch_from_earnapp(devices_endpoint, Device)[1]
 
     @staticmethod
     def get_devices_from_db(table=None) -> List[Device]:
@@ -280,55 +304,78 @@ class Device(BaseModel):
         all_devs = table.scan()
         return [Device(**item) for item in all_devs['Items']]
 
-    @staticmethod
-    def update_devices(dev_l, table=None):
-        if table is None:
-            table = dynamodb.Table('Devices')
-        for dev in dev_l:
-            table.update_item(
-                Key={
-                    'uuid': dev.uuid,
-                    'title': dev.title
-                },
-                UpdateExpression="set bw=:bw, earned=:earned, earned_total=:et, total_bw=:tb, redeem_bw=:rb, ips=:ips, rate=:r, app_id=:aid",
-                ExpressionAttributeValues={
-                    ':earned': dev.earned,
-                    ':et': dev.earned_total,
-                    ':tb': Decimal(dev.total_bw),
-                    ':rb': Decimal(dev.redeem_bw),
-                    ':bw': Decimal(dev.bw),
-                    ':ips': list(map(lambda x: str(x), dev.ips)),
-                    ':r': dev.rate,
-                    ':aid': dev.appid
-                },
-                ReturnValues="UPDATED_NEW"
-            )
+    def update_params(self) -> dict:
+        return dict(
+            Key={
+                'uuid': self.uuid,
+                'title': self.title
+            },
+            UpdateExpression="set bw=:bw, earned=:earned, earned_total=:et, total_bw=:tb, redeem_bw=:rb, ips=:ips, rate=:r, app_id=:aid",
+            ExpressionAttributeValues={
+                ':earned': self.earned,
+                ':et': self.earned_total,
+                ':tb': Decimal(self.total_bw),
+                ':rb': Decimal(self.redeem_bw),
+                ':bw': Decimal(self.bw),
+                ':ips': list(map(lambda x: str(x), self.ips)),
+                ':r': self.rate,
+                ':aid': self.appid
+            }
+        )
 
     @staticmethod
-    def get_traffic_and_earnings(dev_l: List[Device], current_devs: List[Device]) -> str:
+    def get_traffic_and_earnings(dev_l: List[Device], current_devs: List[Device], top_n: int = TOP_DEVICES) -> str:
         dev_map = {dev.uuid: dev for dev in dev_l}
 
         bw_usage = defaultdict(int)
         earned_dict = defaultdict(Decimal)
+        country_dict = {}
 
         for dev in current_devs:
             # the bandwidth used at this moment is the current bandwidth used minus the bandwidth converted to money last time
             bw_used = dev_map[dev.uuid].bw - dev.calculate_bandwidth_used()
             bw_usage[dev.title] += bw_used
+            country_dict[dev.title] = dev.country
 
             # need to calculate money based on total bandwidth used for each device
             earned_dict[dev.title] = bw_usage[dev.title] // ((Decimal(0.01) / current_devs[0].rate) * GIGABYTES)
 
-        ret_l = [f'{k: <15}: {v / MEGABYTES: >8.2f}MB|{earned_dict[k] / 100:>5.2f}$' for (k, v) in bw_usage.items()]
+        # only show top devices by earnings, roll up the others by country
+        top_titles = heapq.nlargest(top_n, bw_usage.keys(), key=lambda k: (earned_dict[k], bw_usage[k]))
+        ret_l = [Device._traffic_line(k, bw_usage[k], earned_dict[k]) for k in top_titles]
+
+        top_set = set(top_titles)
+        country_bw = defaultdict(int)
+        country_earned = defaultdict(Decimal)
+        country_count = defaultdict(int)
+        for k in bw_usage.keys():
+            if k not in top_set:
+                country_bw[country_dict[k]] += bw_usage[k]
+                country_earned[country_dict[k]] += earned_dict[k]
+                country_count[country_dict[k]] += 1
+
+        top_countries = heapq.nlargest(TOP_COUNTRIES, country_bw.keys(),
+                                       key=lambda c: (country_earned[c], country_bw[c]))
+        for c in top_countries:
+            ret_l.append(Device._traffic_line(f'{c} ({country_count[c]})', country_bw[c], country_earned[c]))
+
+        other_countries = [c for c in country_bw.keys() if c not in top_countries]
+        if len(other_countries) > 0:
+            ret_l.append(Device._traffic_line(f'others ({sum(country_count[c] for c in other_countries)})',
+                                              sum(country_bw[c] for c in other_countries),
+                                              sum(country_earned[c] for c in other_countries)))
 
         return '\n'.join(ret_l)
 
+    @staticmethod
+    def _traffic_line(name: str, bw, cents: Decimal) -> str:
+        return f'{name: <15}: {bw / MEGABYTES: >8.2f}MB|{cents / 100:>5.2f}$'
+
 
 class DiscordUtility:
 
     @staticmethod
-    def notify_new_trx(trx_l: List[Transaction], title: str = 'New Redeem Request'):
-        webhook = DiscordWebhook(url=WEBHOOK_URL, rate_limit_retry=True)
+    def trx_embeds(trx_l: List[Transaction], title: str = 'New Redeem Request') -> List[DiscordEmbed]:
         assert len(trx_l) > 0
         trx = trx_l[0]
         if title == 'New Redeem Request':
@@ -343,60 +390,151 @@ class DiscordUtility:
             color="07FF70"
         )
         embed.set_thumbnail(url=EARNAPP_LOGO)
-        for transaction in trx_l:
-            embed.add_embed_field(name="UUID", value=f"{transaction.uuid}")
-            embed.add_embed_field(name="Amount", value=f"+{transaction.money_amount}$")
-            embed.add_embed_field(name="Status", value=f"{transaction.status}")
-            embed.add_embed_field(name="Redeem Date", value=f"{transaction.date.strftime('%Y-%m-%d')}")
 
-        embed.add_embed_field(name="Method", value=f"{trx.payment_method}")
-        embed.add_embed_field(name="Email", value=f"{trx.email}")
+        field_groups = []  # fields of a transaction are kept in the same embed
+        for transaction in trx_l:
+            field_groups.append([
+                ("UUID", f"{transaction.uuid}"),
+                ("Amount", f"+{transaction.money_amount}$"),
+                ("Status", f"{transaction.status}"),
+                ("Redeem Date", f"{transaction.date.strftime('%Y-%m-%d')}")
+            ])
+        field_groups.append([
+            ("Method", f"{trx.payment_method}"),
+            ("Email", f"{trx.email}")
+        ])
 
         footer_text = f"Payment {trx.status} as on {trx.date.strftime('%Y-%m-%d')} via {trx.payment_method}"
 
         embed.set_footer(text=footer_text, icon_url=PAYPAL_ICON)
-        webhook.add_embed(embed)
-        webhook.execute()
-
-
-def lambda_handler(event, context):
-    """Lambda function for notifying EarnApp's changes in balance and bandwidth usage via Discord.
-
-        Parameters
-        ----------
-        event: dict, optional
-            API Gateway Lambda Proxy Input Format
-
-            Event doc: https://docs.aws.amazon.com/apigateway/latest/developerguide/set-up-lambda-proxy-integrations.html#api-gateway-simple-proxy-for-lambda-input-format
-
-        context: object, optional
-            Lambda Context runtime methods and attributes
-
-            Context doc: https://docs.aws.amazon.com/lambda/latest/dg/python-context-object.html
+        return DiscordUtility.paginate(embed, field_groups)
 
-        Returns
-        ------
-        Discord's response: text
+    @staticmethod
+    def split_field(name: str, value: str, limit: int = EMBED_FIELD_VALUE_LIMIT) -> List[Tuple[str, str]]:
+        """
+        Given a field, split its value by lines into fields whose values fit in Discord's field value limit.
+        :return: list of (name, value) of fields
+        """
+        chunks = []
+        chunk = ''
+        for line in value.split('\n'):
+            while len(line) > limit:  # a line which does not fit even in an empty field
+                if chunk:
+                    chunks.append(chunk)
+                    chunk = ''
+                chunks.append(line[:limit])
+                line = line[limit:]
+            if chunk and len(chunk) + 1 + len(line) > limit:
+                chunks.append(chunk)
+                chunk = line
+            else:
+                chunk = f'{chunk}\n{line}' if chunk else line
+        if chunk or not chunks:
+            chunks.append(chunk)
+        return [(name if i == 0 else f'{name} (cont.)', chunk) for i, chunk in enumerate(chunks)]
 
-            Return doc
+    @staticmethod
+    def embed_size(embed: DiscordEmbed) -> int:
+        """
+        Given an embed, return number of characters counted for Discord's embed size limit.
+        :return: number of characters
         """
-    webhook = DiscordWebhook(url=WEBHOOK_URL)
+        size = len(embed.title or '') + len(embed.description or '')
+        if embed.footer:
+            size += len(embed.footer.get('text') or '')
+        if embed.author:
+            size += len(embed.author.get('name') or '')
+        for field in embed.fields:
+            size += len(field['name']) + len(field['value'])
+        return size
 
-    try:
-        earnapp_money = Money.get_money_data_from_earnapp()
-        money_table = dynamodb.Table('Money')
-        db_money = Money.get_money_data(earnapp_money.redeem_details['email'], money_table)
+    @staticmethod
+    def paginate(embed: DiscordEmbed, field_groups: List[List[Tuple[str, str]]]) -> List[DiscordEmbed]:
+        """
+        Given an embed without fields and groups of fields, copy the embed as many times as needed for the fields
+        to fit in Discord's embed limits. Fields in a group are put in the same embed.
+        :return: list of embeds
+        """
+        base_size = DiscordUtility.embed_size(embed)
+        pages = []
+        fields = []
+        size = base_size
+        for group in field_groups:
+            group_size = sum(len(name) + len(value) for (name, value) in group)
+            if fields and (len(fields) + len(group) > EMBED_FIELDS_LIMIT or size + group_size > EMBED_TOTAL_LIMIT):
+                pages.append(fields)
+                fields = []
+                size = base_size
+            fields.extend(group)
+            size += group_size
+        pages.append(fields)
 
-        dev_table = dynamodb.Table('Devices')
-        dev_l = Device.get_devices_info_from_earnapp()  # get latest devices information from EarnApp API
-        current_devs = Device.get_devices_from_db(dev_table)  # get current information from DynamoDB
+        ret = []
+        for fields in pages:
+            page = copy.deepcopy(embed)
+            for (name, value) in fields:
+                page.add_embed_field(name=name, value=value)
+            ret.append(page)
+        return ret
 
-        trx_table = dynamodb.Table('Transactions')
-        non_paid_trx_map = {trx.uuid: trx for trx in Transaction.get_non_paid_trx_from_db(trx_table)
-                            if trx.status == TransactionStatus.approved or
-                            trx.status == TransactionStatus.pending_procedure}
+    @staticmethod
+    def send(embeds: List[DiscordEmbed]):
+        """
+        Given embeds, post them with as few messages as Discord's message limits allow.
+        :return: Discord's response of the last message
+        """
+        messages = []
+        message = []
+        size = 0
+        for embed in embeds:
+            embed_size = DiscordUtility.embed_size(embed)
+            if message and (len(message) >= MESSAGE_EMBEDS_LIMIT or size + embed_size > EMBED_TOTAL_LIMIT):
+                messages.append(message)
+                message = []
+                size = 0
+            message.append(embed)
+            size += embed_size
+        messages.append(message)
+
+        response = None
+        for message in messages:
+            webhook = DiscordWebhook(url=WEBHOOK_URL, rate_limit_retry=True)
+            for embed in message:
+                webhook.add_embed(embed)
+            response = webhook.execute()
+        return response
+
+
+def _encode_snapshot_value(o):
+    # DynamoDB returns numbers as Decimal, keep them exact (float would change e.g. 15.10 to 15.1)
+    if isinstance(o, Decimal):
+        return {'$d': str(o)}
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def _decode_snapshot_value(d: dict):
+    if len(d) == 1 and '$d' in d:
+        return Decimal(d['$d'])
+    return d
+
+
+class RunResult(BaseModel):
+    """Everything a run notifies about and writes back to DynamoDB."""
+    title: str
+    color: str
+    change: Decimal
+    traffic: str
+    money: Money
+    devices: List[Device]
+    new_trx: List[Transaction] = []
+    changed_trx: List[Transaction] = []
 
-        all_trx = Transaction.get_trx_from_earnapp()
+    @staticmethod
+    def build(earnapp_money: Money, db_money: Money, dev_l: List[Device], current_devs: List[Device],
+              all_trx: List[Transaction], db_trx: List[Transaction]) -> RunResult:
+        non_paid_trx_map = {trx.uuid: trx for trx in Transaction.filter_non_paid(db_trx)}
         trx_map = {trx.uuid: trx for trx in all_trx}
         approved_trx_l = [trx for trx in all_trx if trx.status == TransactionStatus.approved
                           and trx.uuid not in non_paid_trx_map
@@ -414,45 +552,371 @@ def lambda_handler(event, context):
             title = f'Balance [{change:.2f} → {earnapp_money.balance}] ({earnapp_money.multiplier:.2f})'
             color = "FF0000"
 
-        embed = DiscordEmbed(
+        # find status changed trx, only notified when there is no new redeem request
+        changed_l = []
+        if len(approved_trx_l) == 0:
+            for uuid in non_paid_trx_map.keys():
+                if trx_map[uuid].status != non_paid_trx_map[uuid].status:  # transaction status changed!
+                    changed_l.append(trx_map[uuid])
+
+        return RunResult(
             title=title,
-            color=color
+            color=color,
+            change=change,
+            traffic=Device.get_traffic_and_earnings(dev_l, current_devs),
+            money=earnapp_money,
+            devices=dev_l,
+            new_trx=approved_trx_l,
+            changed_trx=changed_l
         )
 
-        embed.set_thumbnail(url=EARNAPP_LOGO)
-        embed.add_embed_field(name="Earned", value=f"+{change:.2f}$")
-        embed.add_embed_field(name="Balance", value=f"{earnapp_money.balance:.2f}")
-        embed.add_embed_field(name="Lifetime Balance",
-                              value=f"{earnapp_money.earnings_total:.2f}")
-        embed.add_embed_field(name='Traffic and Earnings',
-                              value=Device.get_traffic_and_earnings(dev_l, current_devs))
-        embed.add_embed_field(name="Total Devices",
-                              value=f"{len(dev_l)}")
+    def to_embeds(self) -> List[DiscordEmbed]:
+        """
+        Render the balance and traffic notification of the run, split within Discord's limits.
+        :return: list of embeds
+        """
+        embed = DiscordEmbed(
+            title=self.title,
+            color=self.color
+        )
 
+        embed.set_thumbnail(url=EARNAPP_LOGO)
         embed.set_footer(text=f"Version: 0.0.1.0", icon_url=PAYPAL_ICON)
         embed.set_timestamp()
 
-        webhook.add_embed(embed)
+        field_groups = [
+            [("Earned", f"+{self.change:.2f}$")],
+            [("Balance", f"{self.money.balance:.2f}")],
+            [("Lifetime Balance", f"{self.money.earnings_total:.2f}")]
+        ]
+        field_groups.extend([field] for field in DiscordUtility.split_field('Traffic and Earnings', self.traffic))
+        field_groups.append([("Total Devices", f"{len(self.devices)}")])
 
-        # notify about redeem or status change of deem request if any
+        return DiscordUtility.paginate(embed, field_groups)
+
+    def trx_embeds(self) -> List[DiscordEmbed]:
+        """
+        Render the notification about new redeem requests or their status changes, if any.
+        :return: list of embeds, empty when there is nothing to notify
+        """
+        if len(self.new_trx) > 0:
+            return DiscordUtility.trx_embeds(self.new_trx)
+        elif len(self.changed_trx) > 0:  # there are trx which have status are updated
+            return DiscordUtility.trx_embeds(self.changed_trx, title='Redeem Requests Status Changed!')
+        return []
 
+    def write_to_db(self, money_table, dev_table, trx_table):
+        """
+        Write transactions, devices and balance of the run with TransactWriteItems, as few requests as the API limits
+        allow (100 actions per request). Transactions come first and the balance is written together with the last
+        of them, so transactions and balance are written atomically as long as they fit in one request (fewer than
+        100 transactions). Otherwise the first requests record transactions without the balance.
+
+        Only actions in the same request are atomic: device updates after the first 100 actions (about 98 devices)
+        are written by later requests. If one of them fails, those devices keep their old bw in DB while the
+        balance is updated, and the earnings of the next run are calculated from the old bw.
+
+        Every request has a ClientRequestToken made from its content, so resending the same request (e.g. by
+        the SDK's retries) is not applied twice. A retried invocation compares against the updated DB and sends
+        different requests; it is safe because the writes are puts and SETs of absolute values.
+        """
+        actions = [{'Put': {'TableName': trx_table.name, 'Item': trx.to_db_item()}} for trx in self.new_trx]
+        actions.extend({'Update': {'TableName': trx_table.name, **trx.update_params()}} for trx in self.changed_trx)
+        actions.append({'Update': {'TableName': money_table.name, **self.money.update_params()}})
+        actions.extend({'Update': {'TableName': dev_table.name, **dev.update_params()}} for dev in self.devices)
+
+        for i in range(0, len(actions), TRANSACT_ITEMS_LIMIT):
+            chunk = actions[i:i + TRANSACT_ITEMS_LIMIT]
+            token = str(uuid5(NAMESPACE_URL, json.dumps(chunk, default=str, sort_keys=True)))  # at most 36 chars
+            money_table.meta.client.transact_write_items(TransactItems=chunk, ClientRequestToken=token)
+
+
+class Snapshot(BaseModel):
+    """Raw EarnApp responses and DynamoDB state before a run, enough to replay the run without network."""
+    captured_at: datetime
+    money: dict
+    devices: list
+    transactions: list
+    db_money: dict
+    db_devices: list
+    db_transactions: list
+    result: Optional[dict] = None  # RunResult (json mode) of the captured run
 
-        # find status changed trx
-        changed_l = []
-        for uuid in non_paid_trx_map.keys():
-            if trx_map[uuid].status != non_paid_trx_map[uuid].status:  # transaction status changed!
-                changed_l.append(trx_map[uuid])
-        is_redeemed = len(approved_trx_l) > 0
-        if is_redeemed:
-            DiscordUtility.notify_new_trx(approved_trx_l)
-            # insert new approved transactions to DynamoDB
-            Transaction.insert_trx_to_dynamodb(approved_trx_l, trx_table)
-        elif len(changed_l) > 0:  # there are trx which have status are updated
-            DiscordUtility.notify_new_trx(changed_l, title='Redeem Requests Status Changed!')
-            Transaction.update_transactions(changed_l, trx_table)  # update trx status
-
-        Device.update_devices(dev_l, dev_table)
-        earnapp_money.write_to_db(money_table)  # always write balance info got from Dashboard to DB
+    @staticmethod
+    def capture(money_table, dev_table, trx_table) -> Snapshot:
+        money, earnapp_money = fetch_from_earnapp(money_endpoint, Money)
+        db_money = money_table.get_item(Key={"email": earnapp_money.redeem_details['email']})
+        return Snapshot(
+            captured_at=datetime.now(),
+            money=money,
+            devices=fetch_from_earnapp(devices_endpoint, Device)[0],
+            transactions=fetch_from_earnapp(transaction_endpoint, Transaction)[0],
+            db_money=db_money['Item'],
+            db_devices=dev_table.scan()['Items'],
+            db_transactions=trx_table.scan()['Items']
+        )
+
+    def process(self) -> RunResult:
+        return RunResult.build(
+            earnapp_money=Money(**self.money),
+            db_money=Money(**self.db_money),
+            dev_l=[Device(**x) for x in self.devices],
+            current_devs=[Device(**item) for item in self.db_devices],
+            all_trx=[Transaction(**x) for x in self.transactions],
+            db_trx=[Transaction.from_db_item(item) for item in self.db_transactions]
+        )
+
+    def write(self, directory: str) -> str:
+        """
+        Given a directory or s3://bucket/prefix, write the snapshot into it (overwriting the same run's snapshot).
+        :return: path or S3 URL of the snapshot file
+        """
+        name = f'{self.captured_at:%Y%m%dT%H%M%S%f}.json.gz'
+        data = gzip.compress(
+            json.dumps(self.model_dump(), default=_encode_snapshot_value, separators=(',', ':')).encode('utf8'))
+        if directory.startswith('s3://'):
+            bucket, _, prefix = directory[len('s3://'):].partition('/')
+            key = f"{prefix.rstrip('/')}/{name}" if prefix else name
+            boto3.client('s3').put_object(Bucket=bucket, Key=key, Body=data)
+            return f's3://{bucket}/{key}'
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    @staticmethod
+    def load(path: str) -> Snapshot:
+        with gzip.open(path, 'rt', encoding='utf8') as f:
+            return Snapshot(**json.load(f, object_hook=_decode_snapshot_value))
+
+
+class Lease(BaseModel):
+    """Lock item in Leases table, held by the invocation which fetches and notifies for an account."""
+    account: str
+    owner: str
+    expires_at: int  # epoch seconds, also used as TTL of the item
+
+    @staticmethod
+    def acquire(account: str, owner: str, seconds: int, table=None) -> Optional[Lease]:
+        """
+        Given an account, take its lease if nobody holds it, it is expired or it is held by the same owner
+        (retry of the same invocation).
+        :return: the lease, or None when another invocation holds it
+        """
+        if table is None:
+            table = dynamodb.Table('Leases')
+        now = int(time.time())
+        lease = Lease(account=account, owner=owner, expires_at=now + seconds)
+        try:
+            table.put_item(
+                Item=lease.model_dump(),
+                ConditionExpression='attribute_not_exists(account) OR expires_at < :now OR #o = :o',
+                ExpressionAttributeNames={
+                    '#o': 'owner'
+                },
+                ExpressionAttributeValues={
+                    ':now': now,
+                    ':o': owner
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+        return lease
+
+    def release(self, table=None):
+        if table is None:
+            table = dynamodb.Table('Leases')
+        try:
+            table.delete_item(
+                Key={
+                    'account': self.account
+                },
+                ConditionExpression='#o = :o',
+                ExpressionAttributeNames={
+                    '#o': 'owner'
+                },
+                ExpressionAttributeValues={
+                    ':o': self.owner
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':  # expired and taken by another
+                raise
+
+    def write_result(self, response: str, table=None):
+        if table is None:
+            table = dynamodb.Table('Leases')
+        table.put_item(Item={
+            'account': f'{self.account}#result',
+            'owner': self.owner,
+            'expires_at': int(time.time()) + RESULT_SECONDS,
+            'response': response
+        })
+
+    @staticmethod
+    def get(account: str, table=None) -> Optional[Lease]:
+        """
+        Given an account, return its lease if somebody holds it.
+        :return: the lease or None
+        """
+        if table is None:
+            table = dynamodb.Table('Leases')
+        item = table.get_item(Key={'account': account}, ConsistentRead=True).get('Item')
+        if item is None or item['expires_at'] < int(time.time()):
+            return None
+        return Lease(**item)
+
+    @staticmethod
+    def get_result(account: str, table=None, owner: Optional[str] = None) -> Optional[str]:
+        """
+        Given an account, return the result of its last invocation if it is not expired yet. If owner is given,
+        only the result written by that invocation is returned.
+        :return: Discord's response text of the last invocation or None
+        """
+        if table is None:
+            table = dynamodb.Table('Leases')
+        resp = table.get_item(Key={'account': f'{account}#result'}, ConsistentRead=True)
+        item = resp.get('Item')
+        if item is None or item['expires_at'] < int(time.time()):  # TTL does not delete expired items immediately
+            return None
+        if owner is not None and item['owner'] != owner:  # result of a previous invocation
+            return None
+        return item['response']
+
+    def wait_result(self, until: float, table=None) -> Optional[str]:
+        """
+        Given the lease held by another invocation, wait for the result of that invocation until it is written,
+        the lease is released or expires, or the time `until` (epoch seconds).
+        :return: Discord's response text of the invocation holding the lease or None
+        """
+        until = min(until, self.expires_at)
+        while True:
+            response = Lease.get_result(self.account, table, owner=self.owner)
+            if response is not None:
+                return response
+            holder = Lease.get(self.account, table)
+            if holder is None or holder.owner != self.owner:  # released, it may have written the result meanwhile
+                return Lease.get_result(self.account, table, owner=self.owner)
+            if time.time() + LEASE_POLL_SECONDS > until:
+                return None
+            time.sleep(LEASE_POLL_SECONDS)
+
+
+def report_metrics(**metrics):
+    """
+    Print metrics in CloudWatch Embedded Metric Format, CloudWatch Logs turns them into metrics.
+    """
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': 'EarnAppMonitor',
+                'Dimensions': [[]],
+                'Metrics': [{'Name': name, 'Unit': 'Milliseconds' if name.endswith('Time') else 'Count'}
+                            for name in metrics.keys()]
+            }]
+        },
+        **metrics
+    }))
+
+
+def lambda_handler(event, context):
+    """Lambda function for notifying EarnApp's changes in balance and bandwidth usage via Discord.
+
+        Parameters
+        ----------
+        event: dict, optional
+            API Gateway Lambda Proxy Input Format
+
+            Event doc: https://docs.aws.amazon.com/apigateway/latest/developerguide/set-up-lambda-proxy-integrations.html#api-gateway-simple-proxy-for-lambda-input-format
+
+        context: object, optional
+            Lambda Context runtime methods and attributes
+
+            Context doc: https://docs.aws.amazon.com/lambda/latest/dg/python-context-object.html
+
+        Returns
+        ------
+        Discord's response: text
+
+            Return doc
+        """
+    lease_table = dynamodb.Table('Leases')
+
+    response = Lease.get_result(LEASE_ACCOUNT, lease_table)
+    if response is not None:  # late arrival, another invocation just finished
+        report_metrics(LeaseAcquired=0, LeaseContended=0, ResultReused=1)
+        return response
+
+    owner = getattr(context, 'aws_request_id', None) or str(uuid4())  # async retries keep the same request id
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        remaining = context.get_remaining_time_in_millis() / 1000
+    else:
+        remaining = LEASE_SECONDS
+    seconds = int(remaining) + 1  # the lease expires when the invocation is stopped anyway
+    deadline = time.time() + remaining - 1  # keep a second to return before the invocation is stopped
+
+    start = time.time()
+    lease = Lease.acquire(LEASE_ACCOUNT, owner, seconds, lease_table)
+    acquire_time = (time.time() - start) * 1000
+    if lease is None:  # another invocation is running, wait for its result
+        holder = Lease.get(LEASE_ACCOUNT, lease_table)
+        if holder is None:  # released just after the acquire
+            response = Lease.get_result(LEASE_ACCOUNT, lease_table)
+        else:
+            response = holder.wait_result(deadline, lease_table)
+        report_metrics(LeaseAcquired=0, LeaseContended=1, ResultReused=int(response is not None),
+                       LeaseAcquireTime=acquire_time, LeaseWaitTime=(time.time() - start) * 1000 - acquire_time)
+        return response if response is not None else 'Skipped: another invocation is running'
+
+    report_metrics(LeaseAcquired=1, LeaseContended=0, ResultReused=0, LeaseAcquireTime=acquire_time)
+    try:
+        response = check_and_notify()
+        # the result is only a cache, failing here would make Lambda retry and notify again
+        try:
+            lease.write_result(response, lease_table)
+        except ClientError as e:
+            print(f'Cannot write result of the invocation: {e}')
+    finally:
+        try:
+            lease.release(lease_table)
+        except ClientError as e:  # the lease expires with the invocation anyway
+            print(f'Cannot release lease: {e}')
+    return response
+
+
+def check_and_notify() -> str:
+    """
+    Fetch EarnApp's information, notify about its changes via Discord and write it to DynamoDB.
+    :return: Discord's response text
+    """
+    try:
+        money_table = dynamodb.Table('Money')
+        dev_table = dynamodb.Table('Devices')
+        trx_table = dynamodb.Table('Transactions')
+
+        # get latest information from EarnApp API and current information from DynamoDB
+        snapshot = Snapshot.capture(money_table, dev_table, trx_table)
+        if CAPTURE_DIR:  # written before processing so that a failed run is captured too
+            snapshot.write(CAPTURE_DIR)
+        result = snapshot.process()
+        if CAPTURE_DIR:
+            snapshot.result = result.model_dump(mode='json')
+            snapshot.write(CAPTURE_DIR)
+
+        embeds = result.to_embeds()
+
+        # notify about redeem or status change of deem request if any
+        trx_embeds = result.trx_embeds()
+        if len(trx_embeds) > 0:
+            DiscordUtility.send(trx_embeds)
+
+        # new or updated transactions, devices and balance info got from Dashboard
+        result.write_to_db(money_table, dev_table, trx_table)
         print('finished')
     except RetryError:
         embed = DiscordEmbed(
@@ -460,9 +924,9 @@ def lambda_handler(event, context):
             description="Cannot get information from Earnapp!!!",
             color="FFFFFF"
         )
-        webhook.add_embed(embed)
+        embeds = [embed]
 
-    response = webhook.execute()
+    response = DiscordUtility.send(embeds)
     return response.text
 
 
@@ -0,0 +1,69 @@
+import argparse
+import cProfile
+import glob
+import os
+import pstats
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()  # load .env file and export content as environment variables: WEBHOOK_URL, TOKEN
+
+try:
+    from .lambda_function import Snapshot  # imported as src.replay (tests)
+except ImportError:
+    from lambda_function import Snapshot  # run as a script from src
+
+
+def load_snapshots(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.json.gz'))))
+        else:
+            files.append(path)
+    return [(f, Snapshot.load(f)) for f in files]
+
+
+def replay(snapshots, repeat=1):
+    """
+    Feed captured runs through the diff, earnings and notification logic (no network, no DynamoDB).
+    :return: list of (file, recorded result, replayed result) for runs whose output does not match
+    """
+    mismatches = []
+    for i in range(repeat):
+        for f, snapshot in snapshots:
+            result = snapshot.process()
+            result.to_embeds()
+            result.trx_embeds()
+            dumped = result.model_dump(mode='json')
+            if i == 0 and snapshot.result is not None and dumped != snapshot.result:
+                mismatches.append((f, snapshot.result, dumped))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured EarnApp runs and profile the pipeline.')
+    parser.add_argument('paths', nargs='+', help='snapshot files or directories containing *.json.gz')
+    parser.add_argument('--repeat', type=int, default=1, help='number of times to replay every snapshot')
+    parser.add_argument('--top', type=int, default=25, help='number of functions to show in the profile')
+    parser.add_argument('--sort', default='cumulative', help='pstats sort key (cumulative, tottime, ...)')
+    args = parser.parse_args()
+
+    snapshots = load_snapshots(args.paths)
+    print(f'loaded {len(snapshots)} snapshots')
+
+    profiler = cProfile.Profile()
+    mismatches = profiler.runcall(replay, snapshots, args.repeat)
+
+    pstats.Stats(profiler).strip_dirs().sort_stats(args.sort).print_stats(args.top)
+
+    for f, expected, actual in mismatches:
+        keys = [k for k in expected.keys() | actual.keys() if expected.get(k) != actual.get(k)]
+        print(f'MISMATCH {f}: {", ".join(sorted(keys))}')
+    print(f'{len(snapshots) * args.repeat} runs replayed, {len(mismatches)} mismatches')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+from datetime import datetime
+from decimal import Decimal
+
+import boto3
+import pytest
+from dotenv import load_dotenv
+from moto import mock_aws
+
+load_dotenv()
+
+import src.lambda_function as lambda_function
+from src.lambda_function import Snapshot
+
+TABLE_KEYS = {
+    'Money': [('email', 'HASH')],
+    'Devices': [('uuid', 'HASH'), ('title', 'RANGE')],
+    'Transactions': [('uuid', 'HASH')],
+    'Leases': [('account', 'HASH')],
+}
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    """In-memory DynamoDB (moto) with the tables of the function, used instead of the real one."""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_aws():
+        resource = boto3.resource('dynamodb', region_name='ap-northeast-1')
+        for name, keys in TABLE_KEYS.items():
+            resource.create_table(
+                TableName=name,
+                KeySchema=[{'AttributeName': attr, 'KeyType': key_type} for (attr, key_type) in keys],
+                AttributeDefinitions=[{'AttributeName': attr, 'AttributeType': 'S'} for (attr, _) in keys],
+                BillingMode='PAY_PER_REQUEST'
+            )
+        monkeypatch.setattr(lambda_function, 'dynamodb', resource)
+        yield resource
+
+
+@pytest.fixture
+def snapshot():
+    # data got from EarnApp Dashboard (after requests.json()) and from DynamoDB
+    return Snapshot(
+        captured_at=datetime(2022, 2, 26, 2, 15),
+        money={'multiplier': 1, 'multiplier_icon': '', 'multiplier_hint': '',
+               'redeem_details': {'email': 'test@example.com', 'payment_method': 'paypal.com', 'min_redeem': 2.5},
+               'balance': 0.54, 'earnings_total': 15.2, 'ref_bonuses': 0, 'ref_bonuses_total': 0,
+               'promo_bonuses': 0, 'promo_bonuses_total': 0, 'referral_part': '10%'},
+        devices=[{'uuid': 'sdk-node-31eb47c5d15849e5917a8028eee266cb', 'appid': 'node_earnapp.com',
+                  'title': 'middle', 'bw': 2340880908, 'total_bw': 7545667030, 'redeem_bw': 5204786122,
+                  'rate': '$0.25/GB', 'earned': 0.54, 'earned_total': 1.78, 'country': 'jp',
+                  'ips': ['218.225.136.137']}],
+        transactions=[{'uuid': '620de578a4395ee504b765ba', 'status': 'paid', 'email': 'test@example.com',
+                       'date': '2022-02-17T06:04:40.370Z', 'payment_method': 'paypal.com',
+                       'payment_date': '2022-02-19T06:04:40.370Z', 'money_amount': 2.81,
+                       'ref_bonuses_amount': 0, 'promo_bonuses_amount': 0}],
+        db_money={'email': 'test@example.com', 'multiplier': Decimal('1'), 'multiplier_icon': '',
+                  'multiplier_hint': '',
+                  'redeem_details': {'email': 'test@example.com', 'payment_method': 'paypal.com',
+                                     'min_redeem': Decimal('2.5')},
+                  'balance': Decimal('0.44'), 'earnings_total': Decimal('15.10'), 'ref_bonuses': Decimal('0'),
+                  'ref_bonuses_total': Decimal('0'), 'promo_bonuses': Decimal('0'),
+                  'promo_bonuses_total': Decimal('0'), 'referral_part': '10%'},
+        db_devices=[{'country': 'jp', 'earned': Decimal('0.06'), 'redeem_bw': Decimal('2607420414'),
+                     'bw': Decimal('264677198'), 'rate': Decimal('0.25'), 'appid': 'node_earnapp.com',
+                     'total_bw': Decimal('2872097612'), 'title': 'middle',
+                     'uuid': 'sdk-node-31eb47c5d15849e5917a8028eee266cb', 'ips': ['222.224.148.183'],
+                     'earned_total': Decimal('0.69')}],
+        db_transactions=[{'uuid': '620de578a4395ee504b765ba', 'status': 'pending_procedure',
+                          'email': 'test@example.com', 'date': '2022-02-17 06:04:40.370000+00:00',
+                          'payment_method': 'paypal.com', 'payment_date': 'None',
+                          'money_amount': Decimal('2.81'), 'ref_bonuses_amount': Decimal('0'),
+                          'promo_bonuses_amount': Decimal('0')}]
+    )
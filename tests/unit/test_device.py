@@ -42,4 +42,20 @@ def test_init_device_from_dynamodb():
     try:
         _ = Device(**res_data2)
     except Exception as exc:
-        assert False, f'Exception is raised with initialization Device: {exc}'
\ No newline at end of file
+        assert False, f'Exception is raised with initialization Device: {exc}'
+
+
+def test_traffic_and_earnings_top_devices():
+    def make_device(i, bw, country):
+        return Device(uuid=f'sdk-node-{i}', title=f'dev{i}', bw=bw, total_bw=bw, redeem_bw=0, rate='$0.25/GB',
+                      earned=0, earned_total=0, country=country, ips=['127.0.0.1'])
+
+    countries = ['jp', 'us', 'de', 'fr', 'gb', 'vn', 'kr']
+    current_devs = [make_device(i, 0, countries[i % len(countries)]) for i in range(100)]
+    dev_l = [make_device(i, i * 100_000_000, countries[i % len(countries)]) for i in range(100)]
+
+    lines = Device.get_traffic_and_earnings(dev_l, current_devs, top_n=3).split('\n')
+
+    assert [line.split(':')[0].strip() for line in lines[:3]] == ['dev99', 'dev98', 'dev97']
+    assert len(lines) == 3 + 5 + 1  # top devices, top countries and others
+    assert lines[-1].startswith('others')
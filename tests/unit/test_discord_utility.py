@@ -0,0 +1,33 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from discord_webhook import DiscordEmbed
+
+from src.lambda_function import DiscordUtility, EMBED_FIELD_VALUE_LIMIT, EMBED_FIELDS_LIMIT, EMBED_TOTAL_LIMIT
+
+
+def test_split_field():
+    value = '\n'.join(f'{i:0>40}' for i in range(100))
+
+    fields = DiscordUtility.split_field('Traffic and Earnings', value)
+
+    assert len(fields) > 1
+    assert fields[0][0] == 'Traffic and Earnings'
+    assert all(len(v) <= EMBED_FIELD_VALUE_LIMIT for (_, v) in fields)
+    assert '\n'.join(v for (_, v) in fields) == value
+
+
+def test_paginate_within_limits():
+    embed = DiscordEmbed(title='New Redeem Request', description='New redeem request has been submitted')
+    field_groups = [[('UUID', 'x' * 24), ('Amount', '+2.81$'), ('Status', 'approved'), ('Redeem Date', '2022-02-17')]
+                    for _ in range(100)]
+    field_groups.append([('Text', 'y' * EMBED_FIELD_VALUE_LIMIT)] * 4)
+
+    pages = DiscordUtility.paginate(embed, field_groups)
+
+    assert sum(len(page.fields) for page in pages) == 404
+    for page in pages:
+        assert len(page.fields) <= EMBED_FIELDS_LIMIT
+        assert len(page.fields) % 4 == 0  # fields of a group are not split
+        assert DiscordUtility.embed_size(page) <= EMBED_TOTAL_LIMIT
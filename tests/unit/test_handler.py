@@ -0,0 +1,88 @@
+from unittest import mock
+
+from botocore.exceptions import ClientError
+from tenacity import wait_none
+
+import src.lambda_function as lambda_function
+
+
+def test_error_payload_sends_error_embed(dynamodb, monkeypatch):
+    monkeypatch.setattr(lambda_function.fetch_from_earnapp.retry, 'wait', wait_none())
+    error_res = mock.Mock()
+    error_res.json.return_value = {'error': 'unauthorized'}  # e.g. expired token
+
+    with mock.patch.object(lambda_function.requests, 'get', return_value=error_res), \
+            mock.patch.object(lambda_function.DiscordUtility, 'send') as send:
+        lambda_function.check_and_notify()
+
+    embeds = send.call_args.args[0]
+    assert [embed.title for embed in embeds] == ['Earning Update Error 🤖']
+
+
+class FakeContext:
+    def __init__(self, request_id, remaining_ms=3000):
+        self.aws_request_id = request_id
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_invocation_during_held_lease_does_not_fetch(dynamodb, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'LEASE_POLL_SECONDS', 0.01)
+    lambda_function.Lease.acquire(lambda_function.LEASE_ACCOUNT, 'leader', 60, dynamodb.Table('Leases'))
+
+    with mock.patch.object(lambda_function, 'check_and_notify') as check_and_notify:
+        response = lambda_function.lambda_handler({}, FakeContext('follower', remaining_ms=1100))
+
+    check_and_notify.assert_not_called()
+    assert response == 'Skipped: another invocation is running'
+
+
+def test_contended_invocation_gets_leader_result(dynamodb, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'LEASE_POLL_SECONDS', 0.01)
+    table = dynamodb.Table('Leases')
+    leader = lambda_function.Lease.acquire(lambda_function.LEASE_ACCOUNT, 'leader', 60, table)
+
+    def leader_finishes(seconds):  # the leader finishes while the follower is waiting
+        leader.write_result('leader response', table)
+        leader.release(table)
+
+    monkeypatch.setattr(lambda_function.time, 'sleep', leader_finishes)
+    with mock.patch.object(lambda_function, 'check_and_notify') as check_and_notify:
+        response = lambda_function.lambda_handler({}, FakeContext('follower'))
+
+    check_and_notify.assert_not_called()
+    assert response == 'leader response'
+
+
+def test_leader_writes_result_for_late_arrivals(dynamodb):
+    with mock.patch.object(lambda_function, 'check_and_notify', return_value='discord response') as check_and_notify:
+        first = lambda_function.lambda_handler({}, FakeContext('first'))
+        second = lambda_function.lambda_handler({}, FakeContext('second'))
+
+    assert check_and_notify.call_count == 1
+    assert first == second == 'discord response'
+
+
+def test_result_write_failure_does_not_fail_invocation(dynamodb):
+    throttled = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+
+    with mock.patch.object(lambda_function, 'check_and_notify', return_value='discord response'), \
+            mock.patch.object(lambda_function.Lease, 'write_result', side_effect=throttled), \
+            mock.patch.object(lambda_function.Lease, 'release', side_effect=throttled):
+        response = lambda_function.lambda_handler({}, FakeContext('leader'))
+
+    assert response == 'discord response'
+
+
+def test_waiting_stops_before_timeout(dynamodb, monkeypatch):
+    lambda_function.Lease.acquire(lambda_function.LEASE_ACCOUNT, 'leader', 60, dynamodb.Table('Leases'))
+
+    with mock.patch.object(lambda_function.Lease, 'wait_result', return_value=None) as wait_result:
+        start = lambda_function.time.time()
+        lambda_function.lambda_handler({}, FakeContext('follower', remaining_ms=9001))
+        elapsed = lambda_function.time.time() - start
+
+    until = wait_result.call_args.args[0]
+    assert until - start <= 9001 / 1000 - 1 + elapsed  # a second is kept to return
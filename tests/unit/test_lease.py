@@ -0,0 +1,82 @@
+import os
+import time
+from uuid import uuid4
+
+import boto3
+import pytest
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.lambda_function import Lease
+
+# set DYNAMODB_ENDPOINT to test against local Dynamodb (docker run -p 8000:8000 amazon/dynamodb-local),
+# otherwise tests run against in-memory DynamoDB (moto)
+DYNAMODB_ENDPOINT = os.environ.get('DYNAMODB_ENDPOINT')
+
+
+@pytest.fixture
+def table(request):
+    if not DYNAMODB_ENDPOINT:
+        yield request.getfixturevalue('dynamodb').Table('Leases')
+        return
+
+    dynamodb = boto3.resource('dynamodb', region_name='ap-northeast-1', endpoint_url=DYNAMODB_ENDPOINT,
+                              aws_access_key_id='local', aws_secret_access_key='local')
+    table = dynamodb.create_table(
+        TableName=f'Leases-{uuid4().hex[:8]}',
+        KeySchema=[{'AttributeName': 'account', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'account', 'AttributeType': 'S'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+    )
+    table.wait_until_exists()
+    yield table
+    table.delete()
+
+
+def test_only_one_invocation_acquires_lease(table):
+    lease = Lease.acquire('account1', 'invocation1', 60, table)
+
+    assert lease is not None
+    assert Lease.acquire('account1', 'invocation2', 60, table) is None
+    assert Lease.acquire('account2', 'invocation2', 60, table) is not None  # other account is not blocked
+    assert Lease.acquire('account1', 'invocation1', 60, table) is not None  # retry of the same invocation
+
+    lease.release(table)
+    assert Lease.acquire('account1', 'invocation2', 60, table) is not None
+
+
+def test_expired_lease_is_taken_over(table):
+    lease = Lease.acquire('account3', 'invocation1', -1, table)
+    new_lease = Lease.acquire('account3', 'invocation2', 60, table)
+
+    assert new_lease is not None
+    lease.release(table)  # does not release the lease taken over by another invocation
+    assert Lease.acquire('account3', 'invocation3', 60, table) is None
+
+
+def test_late_arrival_gets_result(table):
+    assert Lease.get_result('account4', table) is None
+
+    lease = Lease.acquire('account4', 'invocation1', 60, table)
+    lease.write_result('discord response', table)
+    lease.release(table)
+
+    assert Lease.get_result('account4', table) == 'discord response'
+
+    table.update_item(Key={'account': 'account4#result'}, UpdateExpression='set expires_at = :e',
+                      ExpressionAttributeValues={':e': int(time.time()) - 1})
+    assert Lease.get_result('account4', table) is None
+
+
+def test_result_of_previous_invocation_is_not_waited_for(table):
+    previous = Lease.acquire('account5', 'invocation1', 60, table)
+    previous.write_result('previous response', table)
+    previous.release(table)
+    holder = Lease.acquire('account5', 'invocation2', 60, table)
+
+    assert Lease.get('account5', table) == holder
+    assert holder.wait_result(time.time() + 0.1, table) is None
+
+    holder.write_result('response', table)
+    assert holder.wait_result(time.time() + 0.1, table) == 'response'
@@ -0,0 +1,19 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.replay import load_snapshots, replay
+
+
+def test_replay_reports_mismatch(snapshot, tmp_path):
+    snapshot.result = snapshot.process().model_dump(mode='json')
+    snapshot.write(str(tmp_path))
+
+    changed = snapshot.model_copy(deep=True)
+    changed.captured_at = changed.captured_at.replace(minute=16)
+    changed.result = dict(snapshot.result, title='Balance Unchanged! [0.54] (1.00)')
+    changed_path = changed.write(str(tmp_path))
+
+    mismatches = replay(load_snapshots([str(tmp_path)]), repeat=3)
+
+    assert [(f, expected['title']) for (f, expected, _) in mismatches] == [(changed_path, changed.result['title'])]
@@ -0,0 +1,104 @@
+import gzip
+import json
+from decimal import Decimal
+from unittest import mock
+
+import boto3
+import pytest
+from dotenv import load_dotenv
+from moto import mock_aws
+
+load_dotenv()
+
+import src.lambda_function as lambda_function
+from src.lambda_function import Snapshot, DiscordUtility, EMBED_TOTAL_LIMIT, EMBED_FIELDS_LIMIT
+
+
+def test_process_snapshot(snapshot):
+    result = snapshot.process()
+
+    assert result.change == Decimal('0.10')
+    assert result.color == '03F8C4'
+    assert len(result.new_trx) == 0
+    assert [trx.uuid for trx in result.changed_trx] == ['620de578a4395ee504b765ba']
+
+
+def test_render_large_fleet(snapshot):
+    snapshot.devices = [dict(snapshot.devices[0], uuid=f'sdk-node-{i}', title=f'dev{i}', country=f'c{i % 50}')
+                        for i in range(5000)]
+    snapshot.db_devices = [dict(snapshot.db_devices[0], uuid=f'sdk-node-{i}', title=f'dev{i}', country=f'c{i % 50}')
+                           for i in range(5000)]
+    result = snapshot.process()
+
+    embeds = result.to_embeds()
+    trx_embeds = result.trx_embeds()
+
+    assert len(embeds) == 1
+    assert len(trx_embeds) == 1 and trx_embeds[0].title.startswith('Redeem Requests Status Changed!')
+    for embed in embeds + trx_embeds:
+        assert len(embed.fields) <= EMBED_FIELDS_LIMIT
+        assert DiscordUtility.embed_size(embed) <= EMBED_TOTAL_LIMIT
+
+
+def test_write_and_load_snapshot(snapshot, tmp_path):
+    snapshot.result = snapshot.process().model_dump(mode='json')
+
+    loaded = Snapshot.load(snapshot.write(str(tmp_path)))
+
+    assert loaded.db_money['earnings_total'] == Decimal('15.10')
+    assert loaded.process().model_dump(mode='json') == snapshot.result
+
+
+def test_failed_run_is_captured(snapshot, tmp_path, monkeypatch):
+    def fail(self):
+        raise ValueError('bug in processing')
+
+    monkeypatch.setattr(lambda_function, 'CAPTURE_DIR', str(tmp_path))
+    monkeypatch.setattr(Snapshot, 'capture', staticmethod(lambda *tables: snapshot))
+    monkeypatch.setattr(Snapshot, 'process', fail)
+
+    with pytest.raises(ValueError):
+        lambda_function.check_and_notify()
+
+    [path] = tmp_path.iterdir()
+    assert Snapshot.load(str(path)).result is None
+
+
+def test_write_run_result_in_transactions(snapshot, dynamodb):
+    snapshot.devices = [dict(snapshot.devices[0], uuid=f'sdk-node-{i}', title=f'dev{i}') for i in range(150)]
+    snapshot.db_devices = [dict(snapshot.db_devices[0], uuid=f'sdk-node-{i}', title=f'dev{i}') for i in range(150)]
+    result = snapshot.process()
+    tables = [dynamodb.Table(name) for name in ('Money', 'Devices', 'Transactions')]
+    client = dynamodb.meta.client
+
+    with mock.patch.object(client, 'transact_write_items', wraps=client.transact_write_items) as transact:
+        result.write_to_db(*tables)
+        result.write_to_db(*tables)  # retried invocation
+
+    calls = [c.kwargs for c in transact.call_args_list]
+    assert [len(c['TransactItems']) for c in calls] == [100, 1 + 1 + 150 - 100] * 2
+    # changed transaction and balance are written in the same transaction
+    assert [action['Update']['TableName'] for action in calls[0]['TransactItems'][:2]] == ['Transactions', 'Money']
+    assert calls[0]['ClientRequestToken'] != calls[1]['ClientRequestToken']
+    assert [c['ClientRequestToken'] for c in calls[2:]] == [c['ClientRequestToken'] for c in calls[:2]]
+
+    money = dynamodb.Table('Money').get_item(Key={'email': 'test@example.com'})['Item']
+    assert money['balance'] == Decimal('0.54')
+    trx = dynamodb.Table('Transactions').get_item(Key={'uuid': '620de578a4395ee504b765ba'})['Item']
+    assert trx['status'] == 'paid'
+    assert dynamodb.Table('Devices').scan(Select='COUNT')['Count'] == 150
+
+
+def test_write_snapshot_to_s3(snapshot, monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'ap-northeast-1')
+    with mock_aws():
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket='captures', CreateBucketConfiguration={'LocationConstraint': 'ap-northeast-1'})
+
+        url = snapshot.write('s3://captures/earnapp/')
+
+        assert url == 's3://captures/earnapp/20220226T021500000000.json.gz'
+        body = s3.get_object(Bucket='captures', Key='earnapp/20220226T021500000000.json.gz')['Body'].read()
+        assert json.loads(gzip.decompress(body))['money']['balance'] == 0.54